@@ -1,59 +1,75 @@
 import streamlit as st
-from utils.data_loader import load_reviews, load_faqs
+from utils.data_loader import load_faqs, file_mtime, FAQ_PATH
 from utils.faq_processor import FAQProcessor
 from utils.response_generator import ResponseGenerator
+from utils.llm_backend import VLLMBackend
 import os
 from dotenv import load_dotenv
-import openai
 import pandas as pd
-from PIL import Image
 
-# Load environment variables
-load_dotenv()
+# Streamlit re-executes this script on every rerun, so process-wide
+# singletons live behind st.cache_* rather than module globals.
+@st.cache_resource(show_spinner=False)
+def get_openai_api_key():
+    """Load environment variables once per server process"""
+    load_dotenv()
+    return os.getenv("OPENAI_API_KEY")
 
-def local_css(file_name):
+@st.cache_data(show_spinner=False)
+def read_css(file_name, mtime):
+    """Stylesheet contents; mtime is part of the cache key so edits are picked up"""
     with open(file_name) as f:
-        st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+        return f.read()
+
+def local_css(file_name):
+    css = read_css(file_name, os.path.getmtime(file_name))
+    st.markdown(f'<style>{css}</style>', unsafe_allow_html=True)
+
+def faq_file_signature():
+    """Identify the current FAQ spreadsheet so cached resources rebuild when it changes"""
+    if not os.path.exists(FAQ_PATH):
+        return None
+    stat = os.stat(FAQ_PATH)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
 
-# Initialize session state
-if 'faq_processor' not in st.session_state:
-    st.session_state.faq_processor = None
-if 'response_gen' not in st.session_state:
-    st.session_state.response_gen = None
-if 'faqs_loaded' not in st.session_state:
-    st.session_state.faqs_loaded = False
-if 'faqs_processed' not in st.session_state:
-    st.session_state.faqs_processed = False
+# One entry: a new FAQ sheet signature replaces the old processor instead of piling up beside it
+@st.cache_resource(show_spinner=False, max_entries=1)
+def get_processor(openai_api_key, cache_path, faqs_signature):
+    """FAQ processor with a built index, shared across reruns and sessions"""
+    faqs = load_faqs(file_mtime(FAQ_PATH))
+    if not isinstance(faqs, pd.DataFrame) or faqs.empty:
+        raise ValueError("Failed to load FAQs or empty DataFrame")
+    
+    processor = FAQProcessor(openai_api_key, cache_path=cache_path)
+    processor.build_index(faqs)
+    return processor
+
+@st.cache_resource(show_spinner=False)
+def get_response_gen(openai_api_key):
+    # VLLM_BASE_URL switches reply generation to a self-hosted model server
+    vllm_url = os.getenv("VLLM_BASE_URL")
+    if vllm_url:
+        return ResponseGenerator(backend=VLLMBackend(os.getenv("VLLM_MODEL"), base_url=vllm_url))
+    return ResponseGenerator(openai_api_key)
 
 def load_faq_database():
-    """Function to load and process FAQs automatically"""
-    openai_api_key = os.getenv("OPENAI_API_KEY")
+    """Load the shared FAQ processor and response generator"""
+    openai_api_key = get_openai_api_key()
     if not openai_api_key:
         st.error("OpenAI API key not found in environment variables")
-        return False
+        return None
+    if os.getenv("VLLM_BASE_URL") and not os.getenv("VLLM_MODEL"):
+        st.error("VLLM_MODEL must be set when VLLM_BASE_URL is")
+        return None
     
     try:
-        faqs = load_faqs()
-        if not isinstance(faqs, pd.DataFrame) or faqs.empty:
-            st.error("Failed to load FAQs or empty DataFrame")
-            return False
-        
         cache_path = os.path.join('venv', 'faq_embeddings_cache.json')
-        
-        st.session_state.faq_processor = FAQProcessor(
-            openai_api_key,
-            cache_path=cache_path
-        )
-        st.session_state.faq_processor.build_index(faqs)
-        
-        st.session_state.response_gen = ResponseGenerator(openai_api_key)
-        st.session_state.faqs_processed = True
-        st.session_state.faqs_loaded = True
-        return True
+        processor = get_processor(openai_api_key, cache_path, faq_file_signature())
+        return processor, get_response_gen(openai_api_key)
         
     except Exception as e:
         st.error(f"Error loading FAQs: {str(e)}")
-        return False
+        return None
 
 def main():
     local_css("styles.css")
@@ -97,11 +113,12 @@ def main():
         help="Select the tone for generated responses"
     )
     
-    # Automatically load FAQs if not already loaded
-    if not st.session_state.get('faqs_loaded'):
-        with st.spinner("🧠 Loading FAQ database..."):
-            if not load_faq_database():
-                st.stop()
+    # Load FAQs (cached after the first run)
+    with st.spinner("🧠 Loading FAQ database..."):
+        resources = load_faq_database()
+    if resources is None:
+        st.stop()
+    faq_processor, response_gen = resources
     
     # Main content area
     # Query Input Section
@@ -130,24 +147,26 @@ def main():
             with st.spinner("Analyzing review and generating response..."):
                 try:
                     # FAQ Matching
-                    faq_context = st.session_state.faq_processor.find_similar_faqs(
+                    faq_context = faq_processor.find_similar_faqs(
                         user_query,
                         k=3,
-                        threshold=1.8
+                        threshold=0.1
                     )
                     
-                    # Response Generation
-                    response = st.session_state.response_gen.generate_response(
+                    # Display Results, streaming paragraphs as they arrive
+                    st.markdown("---")
+                    st.markdown("### 💬 Generated Response")
+                    placeholder = st.empty()
+                    paragraphs = []
+                    for paragraph in response_gen.iter_sync(response_gen.stream_response(
                         user_query,
                         rating,
                         faq_context,
                         brand_voice.lower()
-                    )
-                    
-                    # Display Results
-                    st.markdown("---")
-                    st.markdown("### 💬 Generated Response")
-                    st.markdown(f'<div class="response-box">{response}</div>', unsafe_allow_html=True)
+                    )):
+                        paragraphs.append(paragraph)
+                        response = '\n\n'.join(paragraphs)
+                        placeholder.markdown(f'<div class="response-box">{response}</div>', unsafe_allow_html=True)
                     
                 except Exception as e:
                     st.error(f"⚠️ Error generating response: {str(e)}")
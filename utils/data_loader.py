@@ -1,8 +1,37 @@
 import pandas as pd
+import streamlit as st
 import os
 
-def clean_apple_reviews(file_path):
-    """Clean Apple App Store reviews data"""
+FAQ_PATH = "data/Chatbot FAQs.xlsx"
+APPLE_REVIEWS_PATH = "data/appstore (1).xlsx"
+GOOGLE_REVIEWS_PATH = "data/Reviews Report 2025.xlsx"
+
+def file_mtime(path):
+    """Modification time of path, or None if it does not exist"""
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def reviews_mtime():
+    """Combined modification times of the review exports, for load_reviews' cache key"""
+    return (file_mtime(APPLE_REVIEWS_PATH), file_mtime(GOOGLE_REVIEWS_PATH))
+
+def _cached_parquet(source_path, loader):
+    """Return loader(source_path), reusing a Parquet copy until the source file changes"""
+    parquet_path = os.path.splitext(source_path)[0] + ".parquet"
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(source_path):
+        try:
+            return pd.read_parquet(parquet_path)
+        except Exception as e:
+            print(f"Error reading {parquet_path}: {str(e)}")
+    
+    df = loader(source_path)
+    if not df.empty:
+        try:
+            df.to_parquet(parquet_path, compression='zstd')
+        except Exception as e:
+            print(f"Error writing {parquet_path}: {str(e)}")
+    return df
+
+def _read_apple_reviews(file_path):
     df = pd.read_excel(file_path, header=None)
     
     apple_reviews = df.iloc[3:, [2, 3, 4, 5, 6]].copy()
@@ -14,7 +43,12 @@ def clean_apple_reviews(file_path):
     apple_reviews['text'] = apple_reviews['title'].fillna('') + ': ' + apple_reviews['body'].fillna('')
     
     return apple_reviews[['text', 'rating', 'date', 'source']]
-def clean_google_reviews(file_path):
+
+def clean_apple_reviews(file_path):
+    """Clean Apple App Store reviews data"""
+    return _cached_parquet(file_path, _read_apple_reviews)
+
+def _read_google_reviews(file_path):
     try:
         df = pd.read_excel(file_path, header=None)
         if df.shape[1] < 12:
@@ -34,38 +68,49 @@ def clean_google_reviews(file_path):
         print(f"Error processing {file_path}: {str(e)}")
         return pd.DataFrame()
 
-def load_faqs():
-    """Load FAQ knowledge base with proper NaN handling"""
-    faq_path = "data/Chatbot FAQs.xlsx"
-    if os.path.exists(faq_path):
-        faqs = pd.read_excel(faq_path, usecols=["User Query", "Product Responses"])
-        
-        faqs = faqs.rename(columns={
-            "User Query": "question",
-            "Product Responses": "answer"
-        })
-        
-        faqs['answer'] = faqs['answer'].fillna('')
-        
-        faqs = faqs.dropna(how='all')
-        
-        return faqs[["question", "answer"]]
+def clean_google_reviews(file_path):
+    return _cached_parquet(file_path, _read_google_reviews)
+
+def _read_faqs(faq_path):
+    faqs = pd.read_excel(faq_path, usecols=["User Query", "Product Responses"])
+    
+    faqs = faqs.rename(columns={
+        "User Query": "question",
+        "Product Responses": "answer"
+    })
+    
+    faqs['answer'] = faqs['answer'].fillna('')
+    
+    faqs = faqs.dropna(how='all')
+    
+    return faqs[["question", "answer"]]
+
+@st.cache_data(show_spinner=False)
+def load_faqs(mtime=None):
+    """Load FAQ knowledge base with proper NaN handling.
+
+    Pass file_mtime(FAQ_PATH) as mtime so edits to the file invalidate the cache.
+    """
+    if os.path.exists(FAQ_PATH):
+        return _cached_parquet(FAQ_PATH, _read_faqs)
     return pd.DataFrame(columns=["question", "answer"])
 
-def load_reviews(platform="all"):
-    """Load and clean reviews from both sources"""
+@st.cache_data(show_spinner=False)
+def load_reviews(platform="all", mtime=None):
+    """Load and clean reviews from both sources.
+
+    Pass reviews_mtime() as mtime so edits to either export invalidate the cache.
+    """
     reviews = []
     
     if platform in ["all", "apple"]:
-        apple_path = "data/appstore (1).xlsx"
-        if os.path.exists(apple_path):
-            apple_df = clean_apple_reviews(apple_path)
+        if os.path.exists(APPLE_REVIEWS_PATH):
+            apple_df = clean_apple_reviews(APPLE_REVIEWS_PATH)
             reviews.append(apple_df)
     
     if platform in ["all", "google"]:
-        google_path = "data/Reviews Report 2025.xlsx"
-        if os.path.exists(google_path):
-            google_df = clean_google_reviews(google_path)
+        if os.path.exists(GOOGLE_REVIEWS_PATH):
+            google_df = clean_google_reviews(GOOGLE_REVIEWS_PATH)
             if not google_df.empty:
                 reviews.append(google_df)
     
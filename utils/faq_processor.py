@@ -1,26 +1,130 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 import numpy as np
-import faiss
 import pandas as pd
 import hashlib
+import xxhash
 import json
 import os
+import glob
+import atexit
+import asyncio
 from tqdm import tqdm
 import time
 import re
+import functools
+import threading
+import weakref
+from collections import OrderedDict
+from utils.rate_limiter import TokenBucket
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Bump when the cache key scheme changes; older stores are migrated on lookup
+CACHE_VERSION = "xxh3v1"
+
+# Account limits; override with OPENAI_RPM / OPENAI_TPM to match your tier
+DEFAULT_RPM = 3000
+DEFAULT_TPM = 1000000
+
+# Retry policy for 429s: the only time an embedding call waits
+_retry_on_rate_limit = retry(
+    retry=retry_if_exception_type(RateLimitError),
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(6),
+    reraise=True
+)
+
+# Below this many FAQs a brute-force SIMD scan beats building a FAISS index
+SIMSIMD_MAX_ROWS = 1000
+
+# From this many FAQs use an HNSW graph instead of an exact flat scan
+HNSW_MIN_ROWS = 2000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Rows allocated for the in-memory vector matrix before it first grows
+INITIAL_CACHE_CAPACITY = 1024
+
+# Write the embedding cache after this many new entries or seconds, whichever comes first
+CACHE_FLUSH_EVERY = 256
+CACHE_FLUSH_INTERVAL = 30
+
+# Sub-question separators: question marks and the words "and"/"also"
+_SPLIT_RE = re.compile(r'\?|\band\b|\balso\b', re.IGNORECASE)
+
+# Number of recent find_similar_faqs results kept per processor
+QUERY_CACHE_SIZE = 256
+
+def _flush_at_exit(processor_ref):
+    """atexit hook that saves a processor's pending embeddings if it is still alive"""
+    processor = processor_ref()
+    if processor is not None:
+        processor.flush()
+
+# Serialises appends to the store files, which processors sharing a cache path write alike
+_STORE_WRITE_LOCK = threading.Lock()
+
 class FAQProcessor:
-    def __init__(self, openai_api_key, cache_path="faq_embeddings_cache.json"):
+    def __init__(self, openai_api_key, cache_path="faq_embeddings_cache.json", quantize=True):
         self.client = OpenAI(api_key=openai_api_key)
+        self.openai_api_key = openai_api_key
+        self.aclient = None
         self.index = None
         self.faq_data = None
+        self._valid_answer_mask = None
+        self._faq_questions = None
+        self._faq_answers = None
+        self.embeddings_matrix = None
+        # int8 search copies (one scale per row); quantize=False keeps float32 for A/B checks
+        self.quantize = quantize
+        self.quantized_matrix = None
+        self.quantized_scales = None
         self.cache_file = cache_path
-        self.embedding_cache = {}
+        base_path = os.path.splitext(cache_path)[0]
+        # Append-only store: raw float32 rows plus one key per line after a JSON header
+        self.vectors_file = base_path + ".f32"
+        self.keys_file = base_path + "_keys.txt"
+        # Earlier whole-file store, read once and carried over on the next save
+        self.npy_vectors_file = base_path + ".npy"
+        self.npy_keys_file = base_path + "_keys.json"
+        self.index_file_prefix = base_path + "_index"
+        # One float32 matrix holds every cached vector; _key_to_row indexes into it.
+        # Rows past _num_rows are spare capacity.
+        self._key_to_row = {}
+        self._cache_keys = []
+        self._vec_matrix = None
+        self._num_rows = 0
+        # Rows already on disk; saves append only rows past this point
+        self._saved_rows = 0
+        self._rewrite_store = False
+        # MD5-keyed vectors from a pre-xxh3 cache, moved over as their texts are seen
+        self._legacy_rows = {}
+        self._legacy_vectors = None
+        self._query_cache = OrderedDict()
+        # Guards the vector store and query cache when sessions share this processor
+        self._lock = threading.RLock()
+        self._last_flush = time.time()
         print(f"Initializing with cache path: {self.cache_file}")
         self._ensure_cache_directory()
         self._load_cache()
-        print(f"Loaded {len(self.embedding_cache)} cached embeddings")
-        self.rate_limit_delay = 0.2  # 200ms between API calls
-        self.last_api_call = 0
+        # Weak reference, so the hook does not keep replaced processors (and their indexes) alive
+        atexit.register(_flush_at_exit, weakref.ref(self))
+        print(f"Loaded {len(self._key_to_row)} cached embeddings")
+        # Shared across threads (Streamlit sessions) and the async build path
+        self.request_limiter = TokenBucket.from_env("OPENAI_RPM", DEFAULT_RPM)
+        self.token_limiter = TokenBucket.from_env("OPENAI_TPM", DEFAULT_TPM)
         self.timeout = 10
 
     def _ensure_cache_directory(self):
@@ -30,213 +134,528 @@ class FAQProcessor:
             os.makedirs(cache_dir)
 
     def _load_cache(self):
-        """Load embeddings cache from file"""
-        if os.path.exists(self.cache_file):
-            try:
+        """Load embeddings cache from the binary vector store"""
+        try:
+            if os.path.exists(self.keys_file):
+                self._load_store()
+            elif os.path.exists(self.npy_vectors_file) and os.path.exists(self.npy_keys_file):
+                with open(self.npy_keys_file, 'r') as f:
+                    stored = json.load(f)
+                vectors = np.load(self.npy_vectors_file, mmap_mode='r')
+                # Stores written before CACHE_VERSION are a bare list of MD5 keys
+                keys = stored.get("keys", []) if isinstance(stored, dict) else stored
+                if len(keys) != len(vectors):
+                    raise ValueError("key and vector counts differ")
+                if isinstance(stored, dict) and stored.get("version") == CACHE_VERSION:
+                    # _saved_rows stays 0, so the first save copies these rows into the append-only store
+                    self._vec_matrix = vectors
+                    self._num_rows = len(vectors)
+                    self._cache_keys = keys
+                    self._key_to_row = {key: row for row, key in enumerate(keys)}
+                else:
+                    self._legacy_vectors = vectors
+                    self._legacy_rows = {key: row for row, key in enumerate(keys)}
+            elif self.cache_file.endswith('.json') and os.path.exists(self.cache_file):
+                # Original JSON cache of MD5 key -> vector
                 with open(self.cache_file, 'r') as f:
-                    self.embedding_cache = json.load(f)
-                print(f"Loaded cache with {len(self.embedding_cache)} embeddings")
-            except Exception as e:
-                print(f"Error loading cache: {e}")
-                self.embedding_cache = {}
+                    legacy = json.load(f)
+                if legacy:
+                    self._legacy_vectors = np.array(list(legacy.values()), dtype=np.float32)
+                    self._legacy_rows = {key: row for row, key in enumerate(legacy)}
+            print(f"Loaded cache with {len(self._key_to_row)} embeddings")
+            if self._legacy_rows:
+                print(f"Found {len(self._legacy_rows)} legacy embeddings to migrate")
+        except Exception as e:
+            print(f"Error loading cache: {e}")
+            self._key_to_row = {}
+            self._cache_keys = []
+            self._vec_matrix = None
+            self._num_rows = 0
+            self._saved_rows = 0
+            self._legacy_rows = {}
+            self._legacy_vectors = None
+            # Start the store over on the next save rather than appending to a bad one
+            self._rewrite_store = True
+
+    def _load_store(self):
+        """Memory-map the append-only store, dropping rows an interrupted save left unpaired"""
+        with open(self.keys_file, 'r') as f:
+            header = json.loads(f.readline())
+            keys = f.read().split()
+        if header.get("version") != CACHE_VERSION:
+            raise ValueError(f"unknown cache version {header.get('version')}")
+        dim = int(header["dim"])
+        row_bytes = dim * np.dtype(np.float32).itemsize
+        file_bytes = os.path.getsize(self.vectors_file) if os.path.exists(self.vectors_file) else 0
+        rows = min(len(keys), file_bytes // row_bytes)
+        if rows != len(keys) or rows * row_bytes != file_bytes:
+            keys = keys[:rows]
+            with open(self.vectors_file, 'ab') as f:
+                f.truncate(rows * row_bytes)
+            with open(self.keys_file, 'w') as f:
+                f.write(json.dumps(header) + "\n" + "".join(key + "\n" for key in keys))
+            print(f"Repaired cache store to {rows} rows")
+        if rows:
+            self._vec_matrix = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(rows, dim))
+        self._num_rows = rows
+        self._saved_rows = rows
+        self._cache_keys = keys
+        self._key_to_row = {key: row for row, key in enumerate(keys)}
 
     def _save_cache(self):
-        """Ensure cache is properly saved"""
-        try:
-            # Create parent directories if they don't exist
-            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        """Append rows added since the last save to the vector and key files"""
+        with self._lock:
+            try:
+                # Create parent directories if they don't exist
+                self._ensure_cache_directory()
             
-            # Write to temporary file first
-            temp_file = self.cache_file + '.tmp'
-            with open(temp_file, 'w') as f:
-                json.dump(self.embedding_cache, f)
+                if self._num_rows <= self._saved_rows:
+                    return
             
-            # Atomic rename
-            os.replace(temp_file, self.cache_file)
-            print(f"Saved cache to {self.cache_file}")
-        except Exception as e:
-            print(f"Cache save failed: {str(e)}")
-            raise
+                with _STORE_WRITE_LOCK:
+                    self._append_pending()
+                self._saved_rows = self._num_rows
+                self._last_flush = time.time()
+            except Exception as e:
+                print(f"Cache save failed: {str(e)}")
+                raise
+
+    def _append_pending(self):
+        """Write rows past _saved_rows to the end of the store files"""
+        if self._rewrite_store or not os.path.exists(self.keys_file):
+            # New store: a header line records the key scheme and vector width
+            with open(self.vectors_file, 'wb'):
+                pass
+            with open(self.keys_file, 'w') as f:
+                f.write(json.dumps({"version": CACHE_VERSION, "dim": int(self._vec_matrix.shape[1])}) + "\n")
+            self._rewrite_store = False
+        
+        # Vectors first: on load, rows without a key are dropped, so a crash
+        # between the two appends never misaligns keys and vectors
+        with open(self.vectors_file, 'ab') as f:
+            f.write(self._vec_matrix[self._saved_rows:self._num_rows].tobytes())
+        with open(self.keys_file, 'a') as f:
+            f.write("".join(key + "\n" for key in self._cache_keys[self._saved_rows:self._num_rows]))
+        print(f"Appended {self._num_rows - self._saved_rows} embeddings to {self.vectors_file}")
+
+    def _add_embedding(self, key, vector):
+        """Write a vector into the next free matrix row and record its key"""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if key in self._key_to_row:
+                return
+            if self._vec_matrix is None:
+                self._vec_matrix = np.empty((INITIAL_CACHE_CAPACITY, len(vector)), dtype=np.float32)
+            elif self._num_rows == len(self._vec_matrix):
+                # Full (or still the read-only memmap from disk): double into a fresh buffer
+                grown = np.empty((max(2 * self._num_rows, INITIAL_CACHE_CAPACITY), self._vec_matrix.shape[1]), dtype=np.float32)
+                grown[:self._num_rows] = self._vec_matrix[:self._num_rows]
+                self._vec_matrix = grown
+            
+            row = self._num_rows
+            self._vec_matrix[row] = vector
+            self._key_to_row[key] = row
+            self._cache_keys.append(key)
+            self._num_rows += 1
+
+    def _get_embeddings(self, keys):
+        """Return an (n, dim) float32 matrix of cached vectors for keys"""
+        with self._lock:
+            rows = [self._key_to_row[key] for key in keys]
+            # Fancy indexing already yields a fresh contiguous float32 copy;
+            # asarray only drops the memmap subclass without copying again
+            return np.asarray(self._vec_matrix[rows])
+
+    def _mark_dirty(self):
+        """Save pending cache entries once enough have accumulated or enough time has passed"""
+        with self._lock:
+            if (self._num_rows - self._saved_rows >= CACHE_FLUSH_EVERY
+                    or time.time() - self._last_flush > CACHE_FLUSH_INTERVAL):
+                self._save_cache()
+
+    def __del__(self):
+        # A replaced processor saves its pending embeddings before it is freed
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def flush(self):
+        """Write any unsaved embeddings to disk"""
+        if self._num_rows > self._saved_rows:
+            try:
+                self._save_cache()
+            except Exception:
+                pass
 
     def _get_cache_key(self, text):
         """Generate consistent cache key for text"""
-        return hashlib.md5(text.encode('utf-8')).hexdigest()
+        return xxhash.xxh3_64_hexdigest(text.encode('utf-8'))
 
-    def embed_batch(self, texts):
-        """Process multiple texts in a single API call"""
-        # Filter out cached texts
+    def _resolve_cache_key(self, text):
+        """Cache key for text, migrating a matching MD5-keyed legacy vector if present"""
+        cache_key = self._get_cache_key(text)
+        if cache_key not in self._key_to_row and self._legacy_rows:
+            with self._lock:
+                legacy_row = self._legacy_rows.pop(hashlib.md5(text.encode('utf-8')).hexdigest(), None)
+                if legacy_row is not None:
+                    self._add_embedding(cache_key, self._legacy_vectors[legacy_row])
+                    self._mark_dirty()
+        return cache_key
+
+    def _embed_many(self, texts):
+        """Return {text: embedding} for texts, embedding uncached ones in one API call"""
+        results = {}
+        cached_texts = []
+        cached_keys = []
         to_process = []
         cache_keys = []
-        for text in texts:
+        for text in dict.fromkeys(texts):
             if not text or not isinstance(text, str):
                 continue
-            cache_key = self._get_cache_key(text)
-            if cache_key not in self.embedding_cache:
+            cache_key = self._resolve_cache_key(text)
+            if cache_key in self._key_to_row:
+                cached_texts.append(text)
+                cached_keys.append(cache_key)
+            else:
                 to_process.append(text)
                 cache_keys.append(cache_key)
         
-        if not to_process:
-            return
+        # Cached vectors come out of the matrix in a single slice
+        if cached_keys:
+            results.update(zip(cached_texts, self._get_embeddings(cached_keys)))
         
-        # Rate limiting
-        time_since_last = time.time() - self.last_api_call
-        if time_since_last < self.rate_limit_delay:
-            time.sleep(self.rate_limit_delay - time_since_last)
+        if not to_process:
+            return results
         
         try:
-            response = self.client.embeddings.create(
-                input=to_process,
-                model="text-embedding-ada-002",
-                timeout=self.timeout
-            )
-            self.last_api_call = time.time()
-            
+            response = self._create_embeddings(to_process)
             # Storing  all results
             for i, embedding in enumerate(response.data):
-                self.embedding_cache[cache_keys[i]] = embedding.embedding
+                vector = np.asarray(embedding.embedding, dtype=np.float32)
+                self._add_embedding(cache_keys[i], vector)
+                results[to_process[i]] = vector
             
-            self._save_cache()
+            self._mark_dirty()
         except Exception as e:
             print(f"Batch embedding error: {e}")
+        
+        return results
+
+    def embed_batch(self, texts):
+        """Process multiple texts in a single API call"""
+        self._embed_many(texts)
 
     def embed_text(self, text):
-        """Get embedding from cache or API with faster rate limiting"""
-        if not text or not isinstance(text, str):
-            return None
-            
-        cache_key = self._get_cache_key(text)
+        """Get embedding from cache or API"""
+        return self._embed_many([text]).get(text)
+
+    def _estimate_tokens(self, texts):
+        """Rough token count (~4 characters per token) for the TPM bucket"""
+        return sum(len(text) for text in texts) // 4 + 1
+
+    @_retry_on_rate_limit
+    def _create_embeddings(self, texts):
+        """One embeddings request, waiting only if the shared RPM/TPM budget is spent"""
+        self.request_limiter.acquire()
+        self.token_limiter.acquire(self._estimate_tokens(texts))
+        return self.client.embeddings.create(
+            input=texts,
+            model=EMBEDDING_MODEL,
+            timeout=self.timeout
+        )
+
+    @_retry_on_rate_limit
+    async def _aembed_batch(self, batch):
+        """Embed one batch with the async client, backing off on rate limits"""
+        await self.request_limiter.acquire_async()
+        await self.token_limiter.acquire_async(self._estimate_tokens(batch))
+        response = await self.aclient.embeddings.create(
+            input=batch,
+            model=EMBEDDING_MODEL,
+            timeout=self.timeout
+        )
+        return [embedding.embedding for embedding in response.data]
+
+    async def _embed_all(self, batches, concurrency=20, on_batch_done=None):
+        """Embed batches concurrently, with at most `concurrency` requests in flight"""
+        sem = asyncio.Semaphore(concurrency)
         
-        # Return cached embedding if available
-        if cache_key in self.embedding_cache:
-            return self.embedding_cache[cache_key]
+        async def run(batch):
+            async with sem:
+                try:
+                    vectors = await self._aembed_batch(batch)
+                except Exception as e:
+                    print(f"Batch embedding error: {e}")
+                    vectors = []
             
-        # Faster rate limiting (50ms instead of 100ms)
-        time_since_last = time.time() - self.last_api_call
-        if time_since_last < 0.05:  # 50ms
-            time.sleep(0.05 - time_since_last)
+            for text, vector in zip(batch, vectors):
+                self._add_embedding(self._get_cache_key(text), vector)
+            if vectors:
+                self._mark_dirty()
+            if on_batch_done:
+                on_batch_done(len(batch))
         
-        # Get embedding from API with timeout
+        # The async client is bound to the event loop, so open one per run
+        self.aclient = AsyncOpenAI(api_key=self.openai_api_key)
         try:
-            response = self.client.embeddings.create(
-                input=text,
-                model="text-embedding-ada-002",
-                timeout=10  # seconds
-            )
-            self.last_api_call = time.time()
-            embedding = response.data[0].embedding
-            self.embedding_cache[cache_key] = embedding
-            self._save_cache()
-            return embedding
-        except Exception as e:
-            print(f"Error getting embedding: {e}")
-            return None
+            await asyncio.gather(*(run(batch) for batch in batches))
+        finally:
+            await self.aclient.close()
+            self.aclient = None
 
-    def build_index(self, faqs_df, batch_size=50, progress_callback=None):
+    def build_index(self, faqs_df, batch_size=100, concurrency=20, progress_callback=None):
         """Build index with batch processing and progress tracking"""
         if faqs_df is None or len(faqs_df) == 0:
             raise ValueError("No FAQs provided")
         
-        self.faq_data = faqs_df
-        embeddings = []
-        total_items = len(faqs_df)
-        processed_count = 0
+        texts = (faqs_df['question'].astype(str) + ' ' + faqs_df['answer'].astype(str)).to_numpy()
+        
+        # Rows that differ only in case or whitespace share one embedding
+        collapsed = pd.Series(texts).str.replace(r'\s+', ' ', regex=True).str.strip().str.lower().to_numpy()
+        _, first_rows, inverse = np.unique(collapsed, return_index=True, return_inverse=True)
+        unique_texts = texts[first_rows]
+        total_items = len(unique_texts)
         
         # First get all cached embeddings
-        cached_count = 0
-        texts_to_process = []
+        unique_keys = np.array([self._resolve_cache_key(text) for text in unique_texts], dtype=object)
+        cached_mask = np.fromiter((key in self._key_to_row for key in unique_keys), dtype=bool, count=total_items)
+        cached_count = int(cached_mask.sum())
+        texts_to_process = unique_texts[~cached_mask].tolist()
+        keys = unique_keys[inverse].tolist()
         
-        for _, row in faqs_df.iterrows():
-            combined_text = f"{row['question']} {row['answer']}"
-            cache_key = self._get_cache_key(combined_text)
-            
-            if cache_key in self.embedding_cache:
-                embeddings.append(self.embedding_cache[cache_key])
-                cached_count += 1
-            else:
-                texts_to_process.append(combined_text)
-            
-            processed_count += 1
-            if progress_callback:
-                progress_callback(processed_count, total_items)
+        processed_count = cached_count
+        if progress_callback:
+            progress_callback(processed_count, total_items)
         
+        print(f"Collapsed {len(texts)} FAQs to {total_items} unique texts")
         print(f"Found {cached_count} cached embeddings")
         print(f"Processing {len(texts_to_process)} new embeddings in batches")
         
-        # Process remaining in batches
-        for i in range(0, len(texts_to_process), batch_size):
-            batch = texts_to_process[i:i+batch_size]
-            self.embed_batch(batch)
-            
-            # Add newly processed embeddings
-            for text in batch:
-                cache_key = self._get_cache_key(text)
-                if cache_key in self.embedding_cache:
-                    embeddings.append(self.embedding_cache[cache_key])
-            
-            processed_count += len(batch)
+        # Process remaining batches concurrently
+        def on_batch_done(count):
+            nonlocal processed_count
+            processed_count += count
             if progress_callback:
                 progress_callback(min(processed_count, total_items), total_items)
         
-        if not embeddings:
+        batches = [texts_to_process[i:i+batch_size] for i in range(0, len(texts_to_process), batch_size)]
+        if batches:
+            asyncio.run(self._embed_all(batches, concurrency=concurrency, on_batch_done=on_batch_done))
+        
+        self.flush()
+        
+        # Keep index rows aligned with faq_data rows, dropping FAQs that failed to embed
+        embedded_mask = np.fromiter((key in self._key_to_row for key in keys), dtype=bool, count=len(keys))
+        if not embedded_mask.any():
             raise ValueError("No valid embeddings generated")
         
-        embeddings = np.array(embeddings).astype('float32')
-        self.index = faiss.IndexFlatL2(embeddings.shape[1])
-        self.index.add(embeddings)
-        print(f"Built index with {len(embeddings)} embeddings")
+        self.faq_data = faqs_df[embedded_mask].reset_index(drop=True)
+        # Plain arrays for the search hot loop, so it never touches pandas per hit
+        answers = self.faq_data['answer'].fillna('').astype(str).str.strip()
+        self._valid_answer_mask = (answers != '').to_numpy()
+        self._faq_questions = self.faq_data['question'].to_numpy()
+        self._faq_answers = answers.to_numpy()
+        self._query_cache.clear()
+        index_keys = [key for key, ok in zip(keys, embedded_mask) if ok]
+        embeddings = self._get_embeddings(index_keys)
+        self._normalize(embeddings)
+        self.embeddings_matrix = None
+        self.quantized_matrix = None
+        self.quantized_scales = None
+        
+        if faiss is not None and len(embeddings) >= SIMSIMD_MAX_ROWS:
+            self.index = self._build_faiss_index(embeddings, index_keys)
+        else:
+            self.index = None
+            if self.quantize:
+                self.quantized_matrix, self.quantized_scales = self._quantize(embeddings)
+            else:
+                self.embeddings_matrix = embeddings
+            print(f"Using brute-force search over {len(embeddings)} embeddings")
         
         if progress_callback:
             progress_callback(total_items, total_items)
 
-    # In faq_processor.py
-    def find_similar_faqs(self, query_text, k=5, threshold=1.5):
-        """Find answers for all questions in multi-question queries"""
+    def _build_faiss_index(self, embeddings, keys):
+        """Exact inner-product index for moderate N, HNSW graph beyond that; persisted to disk"""
+        dim = embeddings.shape[1]
+        use_hnsw = len(embeddings) >= HNSW_MIN_ROWS
+        
+        # The file name fingerprints the model and exact rows, so a changed FAQ set never loads a stale index
+        fingerprint = xxhash.xxh3_64_hexdigest((EMBEDDING_MODEL + ''.join(keys)).encode('utf-8'))
+        kind = ("hnsw" if use_hnsw else "flat") + ("_sq8" if self.quantize else "")
+        index_path = f"{self.index_file_prefix}_{kind}_{fingerprint}.faiss"
+        
+        index = self._read_index(index_path, len(embeddings))
+        if index is None:
+            if use_hnsw and self.quantize:
+                index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            elif use_hnsw:
+                index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            elif self.quantize:
+                index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexFlatIP(dim)
+            if use_hnsw:
+                index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            if not index.is_trained:
+                index.train(embeddings)
+            index.add(embeddings)
+            print(f"Built {kind} index with {len(embeddings)} embeddings")
+            self._write_index(index, index_path)
+        
+        if use_hnsw:
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    def _read_index(self, index_path, expected_rows):
+        """Load a persisted index, memory-mapped where FAISS supports it"""
+        if not os.path.exists(index_path):
+            return None
+        try:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except Exception:
+                # Not every index type can be mapped; fall back to a regular read
+                index = faiss.read_index(index_path)
+            if index.ntotal == expected_rows:
+                print(f"Loaded index from {index_path}")
+                return index
+        except Exception as e:
+            print(f"Error loading index: {e}")
+        return None
+
+    def _write_index(self, index, index_path):
+        """Persist an index and remove ones built for earlier FAQ sets"""
+        try:
+            self._ensure_cache_directory()
+            temp_path = index_path + '.tmp'
+            faiss.write_index(index, temp_path)
+            os.replace(temp_path, index_path)
+            for stale in glob.glob(f"{glob.escape(self.index_file_prefix)}_*.faiss"):
+                if stale != index_path:
+                    os.remove(stale)
+        except Exception as e:
+            print(f"Index save failed: {e}")
+
+    def _normalize(self, vectors):
+        """L2-normalize rows in place so inner product equals cosine similarity"""
+        if faiss is not None:
+            faiss.normalize_L2(vectors)
+        else:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors /= norms
+        return vectors
+
+    def _quantize(self, vectors):
+        """Per-row symmetric int8 quantization; returns (int8 matrix, float32 scales)"""
+        max_abs = np.abs(vectors).max(axis=1)
+        max_abs[max_abs == 0] = 1.0
+        scales = (127.0 / max_abs).astype(np.float32)
+        quantized = np.round(vectors * scales[:, None]).astype(np.int8)
+        return quantized, scales
+
+    def _search(self, queries, k):
+        """Return (similarities, indices) for normalized query rows"""
+        if self.index is not None:
+            return self.index.search(queries, k)
+        return self._simsimd_search(queries, k)
+
+    def _simsimd_search(self, queries, k):
+        """Exact cosine search over the embeddings matrix without FAISS"""
+        if self.quantized_matrix is not None:
+            matrix = self.quantized_matrix
+            queries, query_scales = self._quantize(queries)
+        else:
+            matrix = self.embeddings_matrix
+        
+        k = min(k, len(matrix))
+        if simsimd is not None:
+            # simsimd returns cosine distances (scale-invariant, so int8 rows compare directly)
+            similarities = 1.0 - np.asarray(
+                simsimd.cdist(queries, matrix, metric="cosine"),
+                dtype=np.float32
+            )
+        elif self.quantized_matrix is not None:
+            dots = queries.astype(np.int32) @ matrix.T.astype(np.int32)
+            similarities = dots / (query_scales[:, None] * self.quantized_scales[None, :])
+        else:
+            similarities = queries @ matrix.T
+        
+        indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(similarities, indices, axis=1)
+        order = np.argsort(-top, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    def find_similar_faqs(self, query_text, k=5, threshold=0.25):
+        """Find answers for all questions in multi-question queries.
+
+        threshold is the minimum cosine similarity for a FAQ to count as a match.
+        """
+        query_key = (query_text, k, threshold)
+        with self._lock:
+            if query_key in self._query_cache:
+                self._query_cache.move_to_end(query_key)
+                return [dict(r) for r in self._query_cache[query_key]]
+        
         # First detect if there are multiple questions
         questions = self._split_questions(query_text)
         
         results = []
-        for q in questions:
-            query_embedding = self.embed_text(q.lower().strip())
-            if query_embedding is None:
-                continue
-                
-            query_embedding = np.array([query_embedding]).astype('float32')
-            distances, indices = self.index.search(query_embedding, k)
-            
-            for i, idx in enumerate(indices[0]):
-                if idx >= len(self.faq_data):
-                    continue
-                    
-                faq = self.faq_data.iloc[idx]
-                if not faq['answer'] or pd.isna(faq['answer']):
+        normalized = [q.lower().strip() for q in questions]
+        vectors = self._embed_many(normalized)
+        embedded = [(q, vectors[n]) for q, n in zip(questions, normalized) if n in vectors]
+        if not embedded:
+            return results
+        
+        # One batched search for all sub-questions, written straight into a float32 buffer
+        query_embeddings = np.empty((len(embedded), len(embedded[0][1])), dtype=np.float32)
+        for qi, (_, vec) in enumerate(embedded):
+            query_embeddings[qi] = vec
+        self._normalize(query_embeddings)
+        similarities, indices = self._search(query_embeddings, k)
+        
+        for qi, (q, _) in enumerate(embedded):
+            for idx, similarity in zip(indices[qi], similarities[qi]):
+                if idx < 0 or not self._valid_answer_mask[idx] or similarity < threshold:
                     continue
                     
-                if distances[0][i] <= threshold:
-                    results.append({
-                        "question": q,  # Store the original sub-question
-                    "matched_faq": faq['question'],
-                    "answer": str(faq['answer']).strip(),
-                    "distance": float(distances[0][i])
+                results.append({
+                    "question": q,  # Store the original sub-question
+                    "matched_faq": self._faq_questions[idx],
+                    "answer": self._faq_answers[idx],
+                    "similarity": float(similarity)
                 })
     
         # Deduplicate while keeping best matches
         seen_questions = set()
         final_results = []
-        for r in sorted(results, key=lambda x: x['distance']):
+        for r in sorted(results, key=lambda x: x['similarity'], reverse=True):
             if r['question'] not in seen_questions:
                 final_results.append(r)
                 seen_questions.add(r['question'])
+        
+        # Only remember complete answers so a failed embedding call is retried next time
+        if len(embedded) == len(questions):
+            with self._lock:
+                self._query_cache[query_key] = [dict(r) for r in final_results]
+                if len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
         return final_results
 
-    def _split_questions(self, text):
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def _split_questions(text):
         """Split compound questions into individual questions"""
         # Simple heuristic - split on question marks or "and"/"also"
         questions = []
-        for part in re.split(r'\?|\band\b|\balso\b', text):
+        for part in _SPLIT_RE.split(text):
             part = part.strip()
             if part and any(c.isalpha() for c in part):
                 # Add question mark back if needed
                 if not part.endswith('?'):
                     part += '?'
                 questions.append(part)
-        return questions if questions else [text]
\ No newline at end of file
+        return tuple(questions) if questions else (text,)
@@ -0,0 +1,62 @@
+from openai import AsyncOpenAI
+from typing import Protocol
+import httpx
+
+# Self-hosted vLLM servers have no per-account limits, so bulk jobs can keep far more requests in flight
+VLLM_MAX_CONCURRENCY = 256
+
+
+def _pooled_http_client():
+    """Shared keep-alive pool (HTTP/2 where the server negotiates it)"""
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=300)
+    )
+
+
+class LLMBackend(Protocol):
+    """What ResponseGenerator needs from a chat model provider"""
+    model: str
+    sentiment_model: str
+    max_concurrency: int
+    rate_limited: bool
+    supports_batch: bool
+    # Backends with supports_batch also expose an AsyncOpenAI-compatible `client` for the Batch API
+
+    async def chat(self, messages, **kwargs): ...
+
+    async def aclose(self): ...
+
+
+class OpenAIBackend:
+    """OpenAI's hosted chat models, bounded by the account's RPM/TPM limits"""
+    rate_limited = True
+    supports_batch = True
+
+    def __init__(self, api_key, model="gpt-4-turbo", sentiment_model="gpt-3.5-turbo", max_concurrency=20):
+        self._http = _pooled_http_client()
+        self.client = AsyncOpenAI(api_key=api_key, http_client=self._http)
+        self.model = model
+        self.sentiment_model = sentiment_model
+        self.max_concurrency = max_concurrency
+
+    async def chat(self, messages, **kwargs):
+        kwargs.setdefault("model", self.model)
+        return await self.client.chat.completions.create(messages=messages, **kwargs)
+
+    async def aclose(self):
+        """Close the pooled HTTP connections"""
+        await self._http.aclose()
+
+
+class VLLMBackend(OpenAIBackend):
+    """A vLLM server's OpenAI-compatible endpoint; its scheduler batches concurrent requests"""
+    rate_limited = False
+    supports_batch = False
+
+    def __init__(self, model, base_url="http://vllm:8000/v1", api_key="EMPTY", max_concurrency=VLLM_MAX_CONCURRENCY):
+        self._http = _pooled_http_client()
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._http)
+        self.model = model
+        self.sentiment_model = model
+        self.max_concurrency = max_concurrency
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every caller of one API.
+
+    Holds up to `capacity` tokens and refills at `rate_per_minute`. Callers
+    only wait when the bucket is empty, instead of sleeping before every call.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, var_name, default_per_minute):
+        """Bucket sized from a per-minute limit in the environment, e.g. OPENAI_RPM"""
+        return cls(int(os.getenv(var_name, default_per_minute)))
+
+    def _reserve(self, tokens):
+        """Take tokens if available; otherwise return the seconds to wait"""
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Block the calling thread until tokens are available"""
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """Wait without blocking the event loop until tokens are available"""
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
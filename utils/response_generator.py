@@ -1,137 +1,82 @@
-from openai import OpenAI
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from utils.rate_limiter import TokenBucket
+from utils.llm_backend import OpenAIBackend
+import diskcache
+import functools
+import asyncio
+import hashlib
+import io
+import json
+import orjson
+import os
+import threading
+from types import MappingProxyType
+import re
+import string
+import tiktoken
 import time
+from collections import deque
 
-class ResponseGenerator:
-    def __init__(self, openai_api_key):
-        self.client = OpenAI(api_key=openai_api_key)
-        self.last_call_time = 0
-        self.rate_limit_delay = 1.5
+try:
+    import torch
+    from transformers import pipeline
+except ImportError:
+    pipeline = None
 
-    def _analyze_sentiment(self, text):
-        """Analyze sentiment of the review text using GPT-4-turbo"""
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "Analyze the sentiment of this review text. Respond ONLY with one word: 'positive', 'neutral', or 'negative'."
-                    },
-                    {
-                        "role": "user", 
-                        "content": text
-                    }
-                ],
-                temperature=0.0,
-                max_tokens=10
-            )
-            sentiment = response.choices[0].message.content.lower().strip()
-            return sentiment if sentiment in ['positive', 'neutral', 'negative'] else 'neutral'
-        except Exception as e:
-            print(f"Sentiment analysis error: {str(e)}")
-            return 'neutral'
+# Chat-model limits; override with OPENAI_CHAT_RPM / OPENAI_CHAT_TPM to match your tier
+DEFAULT_CHAT_RPM = 500
+DEFAULT_CHAT_TPM = 30000
 
-    def _get_response_rules(self, rating, sentiment):
-        """Determine response rules based on both rating and sentiment"""
-        # Base rules by rating
-        rules = {
-            5: {
-                "opening": "We're thrilled to hear about your experience!",
-                "closing": "We appreciate you being a valued Zaggle customer!",
-                "emoji": "🌟",
-                "style": "enthusiastic and appreciative"
-            },
-            4: {
-                "opening": "Thank you for your positive feedback!",
-                "closing": "We're glad you had a good experience with Zaggle.",
-                "emoji": "",
-                "style": "warm and professional"
-            },
-            3: {
-                "opening": "Thanks for sharing your feedback with us.",
-                "closing": "Let us know if there's anything else we can assist with.",
-                "emoji": "",
-                "style": "neutral and helpful"
-            },
-            2: {
-                "opening": "We appreciate you bringing this to our attention.",
-                "closing": "Please don't hesitate to reach out if you need further assistance.",
-                "emoji": "",
-                "style": "solution-focused"
-            },
-            1: {
-                "opening": "We sincerely apologize for your experience.",
-                "closing": "Our support team is ready to help resolve this for you.",
-                "emoji": "",
-                "style": "empathetic and action-oriented"
-            }
-        }
-        
-        base_rule = rules.get(rating, rules[3])
-        
-        # Adjust based on sentiment
-        if sentiment == "negative":
-            if rating >= 4:  # High rating but negative sentiment
-                base_rule["opening"] = "We appreciate your honest feedback."
-                base_rule["style"] = "empathetic and solution-focused"
-            base_rule["closing"] = "We're committed to improving your experience."
-            base_rule["emoji"] = ""
-        
-        elif sentiment == "positive" and rating <= 2:
-            base_rule["opening"] = "We appreciate your kind words and take your feedback seriously."
-            base_rule["style"] = "appreciative and solution-focused"
-            
-        return base_rule
+# Errors worth retrying: rate limits, dropped connections and 5xx responses
+_RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
 
-    def _format_faq_context(self, faq_context):
-        """Clean FAQ formatting"""
-        if not faq_context:
-            return "None"
-        return "\n".join([
-            f"{i}. {faq['question']}\n   → {faq['answer']}" 
-            for i, faq in enumerate(faq_context[:3], 1)
-        ])
+# Circuit breaker: after this many failed calls within the window, skip the API for the cooldown
+CIRCUIT_FAILURE_THRESHOLD = 10
+CIRCUIT_WINDOW = 60
+CIRCUIT_COOLDOWN = 30
 
-    def generate_response(self, review_text, review_rating, faq_context=None, brand_voice="professional"):
-        """Generate response considering both rating and sentiment"""
-        try:
-            time_since_last = time.time() - self.last_call_time
-            if time_since_last < self.rate_limit_delay:
-                time.sleep(self.rate_limit_delay - time_since_last)
-            
-            # Analyze sentiment
-            sentiment = self._analyze_sentiment(review_text)
-            
-            # Get response rules
-            response_rules = self._get_response_rules(review_rating, sentiment)
-            
-            # Build prompt
-            prompt = self._build_review_response_prompt(review_text, review_rating, sentiment, faq_context, brand_voice, response_rules)
-            
-            # Generate response
-            response = self.client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[{"role": "system", "content": prompt}],
-                temperature=0.65,
-                max_tokens=400,
-                top_p=0.9
-            )
-            
-            # Post-process and return
-            return self._format_review_response(response.choices[0].message.content)
-            
-        except Exception as e:
-            print(f"API Error: {str(e)}")
-            return self._fallback_response(review_text, review_rating, faq_context)
+SENTIMENTS = ('positive', 'neutral', 'negative')
 
-    def _build_review_response_prompt(self, review_text, rating, sentiment, faq_context, brand_voice, response_rules):
-        """Build prompt specifically for review responses"""
-        return f"""You are crafting an official Zaggle response to a customer review. 
+# Suggested in-process classifier; its labels are already positive/neutral/negative
+LOCAL_SENTIMENT_MODEL = "cardiffnlp/twitter-roberta-base-sentiment-latest"
+
+# Reviews labelled per chat request when classifying a batch without a local model
+SENTIMENT_BATCH_SIZE = 50
+
+# Greeting and sign-off lines dropped from generated replies. The prefix tuple is a
+# cheap C-level first pass; the regex then applies word boundaries to the rare hits
+_SKIP_PREFIXES = ('dear', 'hi ', 'hi\t', 'hello', 'best', 'regards', 'sincerely')
+_SKIP_RE = re.compile(r'^(dear\b|hi\s|hello\b|best\b|regards\b|sincerely\b)', re.IGNORECASE)
+
+def _is_skipped(line):
+    """True for a stripped greeting or sign-off line"""
+    return line.lower().startswith(_SKIP_PREFIXES) and _SKIP_RE.match(line) is not None
+
+def _strip_sentiment_label(block):
+    """Drop a leading sentiment label line from a streamed block, if the model wrote one"""
+    first, _, rest = block.strip().partition("\n")
+    label = first.strip().lower()
+    if label.startswith("sentiment:"):
+        label = label[len("sentiment:"):].strip()
+    return rest if label.strip(' .*') in SENTIMENTS else block
+
+# How the model should lay out its answer: JSON for whole replies, plain text when streaming
+_JSON_OUTPUT = 'Return only a JSON object: {"sentiment": "<positive|neutral|negative>", "response": "<the 3 paragraphs, separated by \\n\\n>"}'
+_TEXT_OUTPUT = "Write the sentiment label alone on the first line, then a blank line, then the 3 paragraphs."
+
+# Review-response prompt scaffold, compiled once; filled per request with substitute()
+_PROMPT_TMPL = string.Template("""You are crafting an official Zaggle response to a customer review. 
 
     REVIEW DETAILS:
-    Rating: {rating} stars
-    Sentiment: {sentiment}
-    Content: {review_text}
+    Rating: $rating stars
+    Content: $review
+
+    RELEVANT FAQS (use where they answer the review):
+$faq
+
+    SENTIMENT:
+$sentiment_section
 
     RESPONSE GUIDELINES:
     1. Strict Formatting Rules:
@@ -147,45 +92,587 @@ class ResponseGenerator:
     - Third paragraph: Provide resolution/next steps
 
     3. Tone Requirements:
+    - Write in a $brand_voice brand voice
     - Must sound like a natural review response
     - Avoid corporate jargon
-    - Match the {sentiment} sentiment appropriately
+    - Match the sentiment you classified appropriately
 
     PROHIBITED FORMATTING:
     - Any bullet points or numbered lists
     - Email signatures or contact information
     - Greetings like "Dear customer"
     - Closings like "Best regards"
-    - Paragraphs longer than 4 sentences"""
+    - Paragraphs longer than 4 sentences
+
+    OUTPUT FORMAT:
+    $output_format""")
+
+# Reply budget: the prompt fixes the output at 3 paragraphs of 2-4 sentences, so the floor
+# covers a full reply plus the JSON wrapper; long reviews get some extra headroom
+MIN_REPLY_TOKENS = 400
+MAX_REPLY_TOKENS = 600
+
+# Cached replies expire so prompt or brand-voice changes eventually take effect
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+
+# Base rules by rating
+_BASE_RULES = {
+    5: {
+        "opening": "We're thrilled to hear about your experience!",
+        "closing": "We appreciate you being a valued Zaggle customer!",
+        "emoji": "🌟",
+        "style": "enthusiastic and appreciative"
+    },
+    4: {
+        "opening": "Thank you for your positive feedback!",
+        "closing": "We're glad you had a good experience with Zaggle.",
+        "emoji": "",
+        "style": "warm and professional"
+    },
+    3: {
+        "opening": "Thanks for sharing your feedback with us.",
+        "closing": "Let us know if there's anything else we can assist with.",
+        "emoji": "",
+        "style": "neutral and helpful"
+    },
+    2: {
+        "opening": "We appreciate you bringing this to our attention.",
+        "closing": "Please don't hesitate to reach out if you need further assistance.",
+        "emoji": "",
+        "style": "solution-focused"
+    },
+    1: {
+        "opening": "We sincerely apologize for your experience.",
+        "closing": "Our support team is ready to help resolve this for you.",
+        "emoji": "",
+        "style": "empathetic and action-oriented"
+    }
+}
+
+def _build_rules(rating, sentiment):
+    """Response rules for one rating/sentiment pair, adjusted from the rating's base rules"""
+    base_rule = dict(_BASE_RULES[rating])
+    
+    # Adjust based on sentiment
+    if sentiment == "negative":
+        if rating >= 4:  # High rating but negative sentiment
+            base_rule["opening"] = "We appreciate your honest feedback."
+            base_rule["style"] = "empathetic and solution-focused"
+        base_rule["closing"] = "We're committed to improving your experience."
+        base_rule["emoji"] = ""
+    
+    elif sentiment == "positive" and rating <= 2:
+        base_rule["opening"] = "We appreciate your kind words and take your feedback seriously."
+        base_rule["style"] = "appreciative and solution-focused"
+        
+    return base_rule
+
+# All 15 rating x sentiment combinations, built once and read-only
+_RULES = {
+    (rating, sentiment): MappingProxyType(_build_rules(rating, sentiment))
+    for rating in _BASE_RULES
+    for sentiment in SENTIMENTS
+}
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the API while the circuit breaker is open"""
+
+
+def _on_own_loop(method):
+    """Run a public coroutine on the generator's loop, whichever loop awaits it.
+
+    The semaphore and pooled HTTP client are bound to that loop, so callers
+    driving the API with their own asyncio.run would otherwise fail.
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        coro = method(self, *args, **kwargs)
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+    return wrapper
+
+
+def _on_own_loop_gen(method):
+    """Async-generator counterpart of _on_own_loop: each step runs on the generator's loop"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        agen = method(self, *args, **kwargs)
+        if asyncio.get_running_loop() is self._loop:
+            async for item in agen:
+                yield item
+            return
+        while True:
+            try:
+                item = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(agen.__anext__(), self._loop))
+            except StopAsyncIteration:
+                return
+            yield item
+    return wrapper
+
+
+class ResponseGenerator:
+    def __init__(self, openai_api_key=None, max_concurrency=20, cache_dir=".resp_cache", cache_ttl=RESPONSE_CACHE_TTL, sentiment_model=None, backend=None):
+        # Any LLMBackend; defaults to OpenAI, or pass a VLLMBackend for self-hosted bulk throughput
+        self.backend = backend or OpenAIBackend(openai_api_key, max_concurrency=max_concurrency)
+        # Raw SDK client for the Batch API; only batch-capable backends expose one
+        self.client = self.backend.client if self.backend.supports_batch else None
+        # Repeated reviews (spam, templates, resubmissions) skip the API entirely
+        self.response_cache = diskcache.Cache(cache_dir)
+        self.cache_ttl = cache_ttl
+        self.max_concurrency = self.backend.max_concurrency
+        self._sem = None
+        self._failures = deque()
+        self._circuit_open_until = 0.0
+        self.request_limiter = TokenBucket.from_env("OPENAI_CHAT_RPM", DEFAULT_CHAT_RPM)
+        self.token_limiter = TokenBucket.from_env("OPENAI_CHAT_TPM", DEFAULT_CHAT_TPM)
+        # tiktoken's encoding is downloaded on first use, so it is only loaded for
+        # rate-limited (OpenAI) backends, which need exact counts for the TPM bucket
+        self._enc = None
+        # All requests run on one long-lived loop so the client's connection pool is
+        # reused across Streamlit reruns and sessions instead of rebuilt per asyncio.run
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        # Optional local classifier (e.g. LOCAL_SENTIMENT_MODEL); without one the
+        # chat model classifies sentiment as part of writing the reply
+        self.sentiment_pipe = self._load_sentiment_pipe(sentiment_model or os.getenv("SENTIMENT_MODEL"))
+
+    def _load_sentiment_pipe(self, model_name):
+        """Load a local sentiment pipeline once, or None if not configured/available"""
+        if not model_name:
+            return None
+        if pipeline is None:
+            print(f"transformers is not installed; ignoring sentiment model {model_name}")
+            return None
+        return pipeline("sentiment-analysis", model=model_name, device=0 if torch.cuda.is_available() else -1)
+
+    def _classify_local(self, texts):
+        """Label texts on the local pipeline; unknown labels fall back to neutral"""
+        labels = [str(result["label"]).lower() for result in self.sentiment_pipe(list(texts), batch_size=32, truncation=True)]
+        return [label if label in SENTIMENTS else 'neutral' for label in labels]
+
+    @_on_own_loop
+    async def aclose(self):
+        """Close the backend's pooled HTTP connections"""
+        await self.backend.aclose()
+
+    def run_sync(self, coro):
+        """Run a coroutine on the generator's event loop from synchronous code"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _count_tokens(self, text):
+        """Exact token count under OpenAI's encoding; ~4 characters per token for other backends"""
+        if not self.backend.rate_limited:
+            return len(text) // 4 + 1
+        if self._enc is None:
+            self._enc = tiktoken.encoding_for_model("gpt-4-turbo")
+        return len(self._enc.encode_ordinary(text))
+
+    def _estimate_tokens(self, messages, max_tokens):
+        """Prompt tokens plus completion budget for the TPM bucket"""
+        return sum(self._count_tokens(m["content"]) for m in messages) + max_tokens
+
+    def _reply_max_tokens(self, review_text):
+        """Completion cap: room for the full 3-paragraph reply, more for long reviews"""
+        return min(MAX_REPLY_TOKENS, max(MIN_REPLY_TOKENS, self._count_tokens(str(review_text)) * 2))
+
+    async def _acquire_tokens(self, estimated_tokens):
+        """Wait until both the request and token budgets allow another call"""
+        if not self.backend.rate_limited:
+            return
+        await self.request_limiter.acquire_async()
+        await self.token_limiter.acquire_async(estimated_tokens)
+
+    async def _chat(self, **kwargs):
+        """One chat completion, skipped while the circuit breaker is open"""
+        if time.monotonic() < self._circuit_open_until:
+            raise CircuitOpenError("OpenAI API temporarily skipped after repeated failures")
+        try:
+            response = await self._create(**kwargs)
+        except _RETRYABLE_ERRORS:
+            self._record_failure()
+            raise
+        self._failures.clear()
+        return response
+
+    def _record_failure(self):
+        """Count a call that failed after retries; open the circuit if too many recently"""
+        now = time.monotonic()
+        self._failures.append(now)
+        while self._failures and self._failures[0] < now - CIRCUIT_WINDOW:
+            self._failures.popleft()
+        if len(self._failures) >= CIRCUIT_FAILURE_THRESHOLD:
+            print(f"Circuit open: {len(self._failures)} API failures in {CIRCUIT_WINDOW}s, pausing for {CIRCUIT_COOLDOWN}s")
+            self._circuit_open_until = now + CIRCUIT_COOLDOWN
+            self._failures.clear()
+
+    @retry(
+        retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+        wait=wait_random_exponential(min=1, max=30),
+        stop=stop_after_attempt(5),
+        reraise=True
+    )
+    async def _create(self, **kwargs):
+        """One chat completion, bounded by the concurrency limit and rate budgets"""
+        if self._sem is None:
+            # Created lazily on the generator's own loop, which every public coroutine runs on
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        async with self._sem:
+            await self._acquire_tokens(self._estimate_tokens(kwargs["messages"], kwargs.get("max_tokens", 0)))
+            return await self.backend.chat(**kwargs)
+
+    def _get_response_rules(self, rating, sentiment):
+        """Determine response rules based on both rating and sentiment"""
+        return _RULES.get((rating, sentiment), _RULES[(3, 'neutral')])
+
+    def _faq_pairs(self, faq_context):
+        """Hashable (question, answer) pairs for the top FAQ matches"""
+        return tuple((faq['question'], faq['answer']) for faq in (faq_context or [])[:3])
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _format_faq_context(faq_pairs):
+        """Clean FAQ formatting; memoised since the same FAQ set recurs across reviews"""
+        if not faq_pairs:
+            return "    None"
+        return "\n".join([
+            f"    {i}. {question}\n       → {answer}" 
+            for i, (question, answer) in enumerate(faq_pairs, 1)
+        ])
+
+    @_on_own_loop
+    async def generate_response(self, review_text, review_rating, faq_context=None, brand_voice="professional", sentiment=None):
+        """Generate response considering both rating and sentiment"""
+        try:
+            # CPU-side work runs on the default thread pool so the loop keeps servicing HTTP
+            request_body, cache_key = await asyncio.to_thread(
+                self._prepare_prompt, review_text, review_rating, faq_context, brand_voice, sentiment
+            )
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            # Generate response; unless already known, the model classifies sentiment in the same call
+            content = await self._call_api(request_body)
+            
+            # Post-process off the event loop so other in-flight requests keep moving
+            formatted = await asyncio.to_thread(self._parse_and_format, content)
+            self.response_cache.set(cache_key, formatted, expire=self.cache_ttl)
+            return formatted
+            
+        except CircuitOpenError:
+            return self._fallback_response(review_text, review_rating, faq_context)
+        except _RETRYABLE_ERRORS as e:
+            print(f"API unavailable after retries: {str(e)}")
+            return self._fallback_response(review_text, review_rating, faq_context)
+        except Exception as e:
+            print(f"API Error: {str(e)}")
+            return self._fallback_response(review_text, review_rating, faq_context)
+
+    def _prepare_prompt(self, review_text, review_rating, faq_context, brand_voice, sentiment):
+        """Request body and cache key for one review (local sentiment, rules, prompt, hash)"""
+        if sentiment is None and self.sentiment_pipe is not None:
+            sentiment = self._classify_local([review_text])[0]
+        request_body = self._request_body(review_text, review_rating, faq_context, brand_voice, sentiment=sentiment)
+        return request_body, self._response_cache_key(request_body)
+
+    async def _call_api(self, request_body):
+        """Send one prepared request and return the raw message content"""
+        response = await self._chat(**request_body)
+        choice = response.choices[0]
+        if choice.finish_reason == "length":
+            # A cut-off JSON reply cannot be parsed; fail so nothing is cached
+            raise ValueError(f"reply truncated at max_tokens={request_body['max_tokens']}")
+        return choice.message.content
+
+    def _response_cache_key(self, request_body):
+        """Content hash of everything sent to the model (rating, voice, review text, params)"""
+        return hashlib.blake2b(json.dumps(request_body, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _request_body(self, review_text, review_rating, faq_context=None, brand_voice="professional", stream=False, sentiment=None):
+        """Chat completion parameters for one review, shared by the live, streaming and batch paths"""
+        prompt = self._build_review_response_prompt(review_text, review_rating, faq_context, brand_voice, stream, sentiment)
+        body = {
+            "model": self.backend.model,
+            "messages": [{"role": "system", "content": prompt}],
+            "temperature": 0.65,
+            "max_tokens": self._reply_max_tokens(review_text),
+            "top_p": 0.9
+        }
+        if stream:
+            body["stream"] = True
+        else:
+            body["response_format"] = {"type": "json_object"}
+        return body
+
+    @_on_own_loop_gen
+    async def stream_response(self, review_text, review_rating, faq_context=None, brand_voice="professional", sentiment=None):
+        """Yield the reply paragraph by paragraph as the model finishes each one"""
+        if sentiment is None and self.sentiment_pipe is not None:
+            # Model inference runs on a worker thread so the shared loop keeps serving other sessions
+            sentiment = (await asyncio.to_thread(self._classify_local, [review_text]))[0]
+        # Shares cache entries with generate_response, so key on the non-streaming request
+        cache_key = self._response_cache_key(self._request_body(review_text, review_rating, faq_context, brand_voice, sentiment=sentiment))
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            for paragraph in cached.split('\n\n'):
+                if paragraph:
+                    yield paragraph
+            return
+        
+        paragraphs = []
+        try:
+            stream = await self._chat(**self._request_body(review_text, review_rating, faq_context, brand_voice, stream=True, sentiment=sentiment))
+            buffer = ""
+            header_pending = True
+            finish_reason = None
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                buffer += chunk.choices[0].delta.content or ""
+                while "\n\n" in buffer and len(paragraphs) < 3:
+                    block, buffer = buffer.split("\n\n", 1)
+                    if header_pending:
+                        # The first line should be the sentiment label; anything after it is reply text
+                        header_pending = False
+                        block = _strip_sentiment_label(block)
+                    paragraph = self._clean_paragraph(block)
+                    if paragraph:
+                        paragraphs.append(paragraph)
+                        yield paragraph
+            
+            if header_pending:
+                buffer = _strip_sentiment_label(buffer)
+            paragraph = self._clean_paragraph(buffer)
+            if paragraph and len(paragraphs) < 3:
+                paragraphs.append(paragraph)
+                yield paragraph
+            
+            if finish_reason == "length":
+                print("API Error: streamed reply truncated at max_tokens")
+            if not paragraphs:
+                yield self._fallback_response(review_text, review_rating, faq_context)
+            elif len(paragraphs) == 3 and finish_reason == "stop":
+                # Only complete replies are cached; short or cut-off ones are regenerated next time
+                self.response_cache.set(cache_key, self._format_review_response("\n\n".join(paragraphs)), expire=self.cache_ttl)
+            
+        except Exception as e:
+            print(f"API Error: {str(e)}")
+            if not paragraphs:
+                yield self._fallback_response(review_text, review_rating, faq_context)
+
+    def iter_sync(self, agen):
+        """Iterate an async generator from synchronous code via the generator's event loop"""
+        while True:
+            try:
+                yield self.run_sync(agen.__anext__())
+            except StopAsyncIteration:
+                return
+
+    async def _analyze_sentiment_batch(self, texts):
+        """Sentiment labels for many texts, in order; None where a label could not be obtained"""
+        if self.sentiment_pipe is not None:
+            return await asyncio.to_thread(self._classify_local, texts)
+        chunks = [texts[i:i + SENTIMENT_BATCH_SIZE] for i in range(0, len(texts), SENTIMENT_BATCH_SIZE)]
+        results = await asyncio.gather(*(self._classify_chunk(chunk) for chunk in chunks))
+        return [label for labels in results for label in labels]
+
+    async def _classify_chunk(self, texts):
+        """Classify a numbered list of texts in one chat request"""
+        numbered = "\n".join(f"{i}. {' '.join(str(text).split())}" for i, text in enumerate(texts, 1))
+        prompt = f"""Classify the sentiment of each customer review below as exactly one of: positive, neutral, negative.
+    Return a JSON array of sentiments, one per input, in order, as a JSON object: {{"sentiments": [...]}}
+
+    REVIEWS:
+{numbered}"""
+        try:
+            response = await self._chat(
+                model=self.backend.sentiment_model,
+                messages=[{"role": "system", "content": prompt}],
+                temperature=0,
+                max_tokens=4 * len(texts) + 20,
+                response_format={"type": "json_object"}
+            )
+            labels = orjson.loads(response.choices[0].message.content).get("sentiments", [])
+            if len(labels) != len(texts):
+                raise ValueError(f"expected {len(texts)} sentiments, got {len(labels)}")
+            labels = [str(label).lower().strip() for label in labels]
+            return [label if label in SENTIMENTS else None for label in labels]
+        except Exception as e:
+            # Unlabelled reviews are classified inside their own reply request instead
+            print(f"Sentiment batch failed: {str(e)}")
+            return [None] * len(texts)
+
+    async def _with_sentiments(self, reviews):
+        """Copies of the review dicts with sentiment filled in from one batched classification"""
+        reviews = [dict(review) for review in reviews]
+        pending = [review for review in reviews if review.get("sentiment") is None]
+        if pending:
+            labels = await self._analyze_sentiment_batch([review["review_text"] for review in pending])
+            for review, label in zip(pending, labels):
+                review["sentiment"] = label
+        return reviews
+
+    @_on_own_loop
+    async def generate_many(self, reviews, urgent=True):
+        """Generate responses for many reviews.
+
+        reviews is a list of dicts of generate_response keyword arguments, optionally
+        with a "review_id". Urgent work has sentiments classified for the whole list
+        up front, runs concurrently now and returns the responses. Otherwise the
+        reviews go to the Batch API and the batch id is returned; there sentiment is
+        classified in-prompt unless a local classifier is configured.
+        """
+        if urgent or self.sentiment_pipe is not None:
+            reviews = await self._with_sentiments(reviews)
+        if not urgent:
+            return await self.submit_batch(reviews)
+        return await asyncio.gather(*(
+            self.generate_response(**{k: v for k, v in review.items() if k != "review_id"})
+            for review in reviews
+        ))
+
+    @_on_own_loop
+    async def submit_batch(self, reviews):
+        """Queue reviews on the OpenAI Batch API (half price, completes within 24h)"""
+        if not self.backend.supports_batch:
+            raise RuntimeError(f"{type(self.backend).__name__} has no Batch API; use generate_many(urgent=True)")
+        lines = []
+        for i, review in enumerate(reviews):
+            params = {k: v for k, v in review.items() if k != "review_id"}
+            lines.append(json.dumps({
+                "custom_id": str(review.get("review_id", i)),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._request_body(**params)
+            }))
+        
+        batch_file = await self.client.files.create(
+            file=("review_responses.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    @_on_own_loop
+    async def poll_batch(self, batch_id):
+        """Current status of a submitted batch, e.g. 'in_progress' or 'completed'"""
+        batch = await self.client.batches.retrieve(batch_id)
+        return batch.status
+
+    @_on_own_loop
+    async def fetch_batch_results(self, batch_id):
+        """Download a completed batch as {review_id: formatted response}; failed items map to None"""
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.status != "completed" or not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch_id} is not ready (status: {batch.status})")
+        
+        output = await self.client.files.content(batch.output_file_id)
+        results = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = orjson.loads(line)
+            response = item.get("response") or {}
+            try:
+                if item.get("error") or response.get("status_code") != 200:
+                    raise ValueError(item.get("error") or response.get("status_code"))
+                content = response["body"]["choices"][0]["message"]["content"]
+                results[item["custom_id"]] = self._parse_and_format(content)
+            except Exception as e:
+                print(f"Batch item {item.get('custom_id')} failed: {str(e)}")
+                results[item.get("custom_id")] = None
+        return results
+
+    def _parse_structured_response(self, content):
+        """Split the model's JSON reply into (sentiment, response text)"""
+        payload = orjson.loads(content)
+        sentiment = str(payload.get("sentiment", "")).lower().strip()
+        if sentiment not in SENTIMENTS:
+            sentiment = 'neutral'
+        return sentiment, str(payload.get("response", ""))
+
+    def _parse_and_format(self, content):
+        """Formatted reply text from the model's raw JSON content"""
+        _, reply = self._parse_structured_response(content)
+        return self._format_review_response(reply)
+
+    def _format_sentiment_rules(self, rating, sentiments=SENTIMENTS):
+        """Tone guidance for each sentiment the model may classify the review as"""
+        lines = []
+        for sentiment in sentiments:
+            rules = self._get_response_rules(rating, sentiment)
+            emoji = f" You may use {rules['emoji']}." if rules["emoji"] else ""
+            lines.append(
+                f'    - If {sentiment}: open in the spirit of "{rules["opening"]}", '
+                f'close in the spirit of "{rules["closing"]}", and keep the tone {rules["style"]}.{emoji}'
+            )
+        return "\n".join(lines)
+
+    def _sentiment_section(self, rating, sentiment):
+        """Ask the model to classify sentiment, or state the label the local classifier assigned"""
+        if sentiment in SENTIMENTS:
+            return f"""    The review's sentiment is {sentiment}. Apply this tone:
+{self._format_sentiment_rules(rating, (sentiment,))}"""
+        return f"""    First classify the review's sentiment as exactly one of: positive, neutral, negative.
+    Then apply the matching tone:
+{self._format_sentiment_rules(rating)}"""
+
+    def _build_review_response_prompt(self, review_text, rating, faq_context, brand_voice, stream=False, sentiment=None):
+        """Build prompt specifically for review responses"""
+        return _PROMPT_TMPL.substitute(
+            rating=rating,
+            review=review_text,
+            brand_voice=brand_voice,
+            faq=self._format_faq_context(self._faq_pairs(faq_context)),
+            sentiment_section=self._sentiment_section(rating, sentiment),
+            output_format=_TEXT_OUTPUT if stream else _JSON_OUTPUT
+        )
+
+    def _clean_paragraph(self, block):
+        """Join a paragraph's lines, dropping greeting and sign-off lines"""
+        return ' '.join(
+            line.strip() for line in block.splitlines()
+            if line.strip() and not _is_skipped(line.strip())
+        )
 
     def _format_review_response(self, response):
         """Format the response specifically for review replies"""
-        # Split into paragraphs while preserving blank lines
-        paragraphs = []
-        current_para = []
+        # Write paragraphs straight into one buffer, stopping once 3 are complete
+        buf = io.StringIO()
+        paragraphs = 0
+        in_para = False
         
-        for line in response.split('\n'):
+        for line in response.splitlines():
             stripped_line = line.strip()
             if not stripped_line:
-                if current_para:
-                    paragraphs.append(' '.join(current_para))
-                    current_para = []
-            else:
-                # Skip any unwanted lines
-                if not any(stripped_line.lower().startswith(word) 
-                        for word in ['dear', 'hi ', 'hello', 'best', 'regards', 'sincerely']):
-                    current_para.append(stripped_line)
+                if in_para:
+                    paragraphs += 1
+                    in_para = False
+                    if paragraphs == 3:
+                        break
+            # Skip any unwanted lines
+            elif not _is_skipped(stripped_line):
+                if in_para:
+                    buf.write(' ')
+                elif paragraphs:
+                    buf.write('\n\n')
+                buf.write(stripped_line)
+                in_para = True
         
-        if current_para:
-            paragraphs.append(' '.join(current_para))
+        if in_para:
+            paragraphs += 1
         
-        # Ensure exactly 3 paragraphs with proper spacing
-        if len(paragraphs) > 3:
-            paragraphs = paragraphs[:3]
-        elif len(paragraphs) < 3:
-            paragraphs.extend([""] * (3 - len(paragraphs)))
+        # Pad with empty paragraphs so there are always exactly 3
+        if paragraphs < 3:
+            buf.write('\n\n' * (3 - max(paragraphs, 1)))
         
-        return '\n\n'.join(paragraphs)
+        return buf.getvalue()
 
     def _fallback_response(self, review_text, rating, faq_context):
         """Minimal fallback that still helps"""